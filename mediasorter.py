@@ -20,49 +20,312 @@
 ###############################################################################
 
 import os
+import atexit
+import errno
+import fcntl
 import pwd
 import grp
 import re
 import requests
 import json
-import subprocess
+import hashlib
+import shutil
+import stat
+import threading
 import click
 import yaml
-from pathlib import Path
+from urllib.parse import quote_plus
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Filename parsing patterns, compiled once at import
+_RE_SXXEYY = re.compile(r'[Ss]([0-9]+)[Ee]([0-9]+)')
+# Season with optional episode (S01, S01E02) or a bare episode (E02), in one pass
+_RE_SE = re.compile(r'[Ss]([0-9]+)(?:[Ee]([0-9]+))?|[Ee]([0-9]+)')
+_RE_EPISODE_WORD = re.compile(r'[Ee]pisode')
+_RE_DIGITS = re.compile(r'([0-9]+)')
+_RE_THE_PLUS = re.compile(r'[Tt]he\+')
+
+def sha256_file(path):
+    """
+    Return the hex SHA256 digest of the file at path
+    """
+
+    # hashlib uses OpenSSL, and with it the CPU's SHA extensions where available; hashing
+    # releases the GIL, so parallel sorting threads hash concurrently
+    sha256 = hashlib.sha256()
+    # Read into one reused buffer rather than allocating a new chunk for every read
+    buffer = bytearray(1 << 20)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as fh:
+        while True:
+            size = fh.readinto(buffer)
+            if not size:
+                break
+            sha256.update(view[:size])
+    return sha256.hexdigest()
+
+# ioctl request to clone a file's extents (a reflink) on copy-on-write filesystems
+FICLONE = 0x40049409
+
+# The process umask; it can only be read by setting it, so do that once, before any threads exist
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def copy_file(srcpath, dstpath):
+    """
+    Copy a file, as an instant reflink where the filesystem supports it
+    """
+
+    with open(srcpath, 'rb') as src_fh, open(dstpath, 'wb') as dst_fh:
+        src_mode = stat.S_IMODE(os.fstat(src_fh.fileno()).st_mode)
+        try:
+            fcntl.ioctl(dst_fh.fileno(), FICLONE, src_fh.fileno())
+            reflinked = True
+        except OSError:
+            reflinked = False
+    if not reflinked:
+        # Uses in-kernel copying (sendfile) rather than buffering through userspace
+        shutil.copyfile(srcpath, dstpath)
+    # Like plain cp, take the source's permissions with the umask applied
+    os.chmod(dstpath, src_mode & ~UMASK)
+
+def move_file(srcpath, dstpath):
+    """
+    Move a file, falling back to copying it only when crossing filesystems
+    """
+
+    # A plain rename is a single syscall; shutil.move would first stat both paths
+    try:
+        os.rename(srcpath, dstpath)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(srcpath, dstpath)
+
+# Sort actions: the function performing each in-process, and the equivalent shell command
+# shown by --dryrun
+SORT_ACTIONS = {
+    'symlink':  (os.symlink, ['ln', '-s']),
+    'hardlink': (os.link, ['ln']),
+    'copy':     (copy_file, ['cp']),
+    'move':     (move_file, ['mv']),
+}
+
+# Serializes output from parallel sorting threads
+_logger_lock = threading.Lock()
+# While a parallel sorting thread works on a file, its messages are held here and then written out
+# together, so the output for each file stays in one piece
+_log_buffer = threading.local()
 
 def logger(config, msg, nl=True, stderr=True):
-    click.echo(msg, nl=nl, err=stderr)
+    log_entry = (datetime.now(), msg, nl, stderr)
+    buffered_entries = getattr(_log_buffer, 'entries', None)
+    if buffered_entries is not None:
+        buffered_entries.append(log_entry)
+        return
+
+    flush_log(config, [log_entry])
+
+def flush_log(config, log_entries):
+    # Opened once in cli_root if file logging is enabled
+    logfh = config.get('logfh', None)
+
+    with _logger_lock:
+        for timestamp, msg, nl, stderr in log_entries:
+            click.echo(msg, nl=nl, err=stderr)
+
+            if logfh:
+                logfh.write(f'{timestamp} {msg}\n')
+
+def buffer_log(log_entries, func, *args):
+    """
+    Run func, appending its log messages to log_entries instead of writing them out
+    """
+
+    _log_buffer.entries = log_entries
+    try:
+        return func(*args)
+    finally:
+        _log_buffer.entries = None
+
+# Timeout in seconds for metadata API requests
+API_TIMEOUT = 10
+
+def api_session(config):
+    """
+    Return a requests Session pooling enough connections for every parallel sorting thread
+    """
+
+    # The session keeps connections alive between API calls, saving a TCP+TLS handshake each
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=config['parallelism'])
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Log in to TVDB once per run
+def tvdb_login(config):
+    """
+    Return a requests Session authenticated against TVDB, or None on failure
+    """
+
+    tvdb_session = api_session(config)
+    tvdb_login_url = f"{config['tvdb_api_base']}/login"
+    try:
+        data = {"apikey": config['tvdb_api_key'], "pin": ""}
+        response = tvdb_session.post(
+            tvdb_login_url,
+            data=json.dumps(data),
+            headers={"Content-Type": "application/json"},
+            timeout=API_TIMEOUT
+        )
+        tvdb_token = response.json()['data']['token']
+    except Exception:
+        logger(config, "Failed to log in to TVDB")
+        return None
 
-    log_to_file = config.get('log_to_file', False)
-    logfile  = config.get('logfile', False)
+    tvdb_session.headers["Authorization"] = f"Bearer {tvdb_token}"
+    return tvdb_session
 
-    if log_to_file and logfile:
-        with open(logfile, 'a') as logfhd:
-            logfhd.write(str(datetime.now()) + ' ' + str(msg) + '\n')
+# Metadata lookup caches; many files in a run share the same show or movie
+_tvdb_search_cache = {}
+_tvdb_episodes_cache = {}
+_tmdb_search_cache = {}
+_tvdb_series_id_cache = {}
+
+# Per-key locks, so parallel files looking up the same key wait for a single request
+_lookup_locks = {}
+_lookup_locks_lock = threading.Lock()
+
+def lookup_lock(key):
+    with _lookup_locks_lock:
+        return _lookup_locks.setdefault(key, threading.Lock())
+
+def tvdb_search(config, tvdb_session, search_series_title):
+    """
+    Search TVDB for a series title, returning the list of results or None on failure
+    """
+
+    with lookup_lock(('tvdb_search', search_series_title)):
+        if search_series_title in _tvdb_search_cache:
+            return _tvdb_search_cache[search_series_title]
+
+        show_url = config['tvdb_api_search_url'].format(show=quote_plus(search_series_title))
+        logger(config, f"TVDB API Search URL:   {show_url}")
+        try:
+            response = tvdb_session.get(show_url, timeout=API_TIMEOUT)
+            show_data = response.json()
+            if show_data["status"] != "success":
+                raise ValueError
+        except Exception:
+            logger(config, f"Failed to find results for {show_url}")
+            return None
+
+        _tvdb_search_cache[search_series_title] = show_data['data']
+        return show_data['data']
+
+def tvdb_episode(config, tvdb_session, series_id, season_id, episode_id):
+    """
+    Fetch an episode of a TVDB series, returning (series, episode) data or None if not found
+    """
+
+    series_url = config['tvdb_api_series_url'].format(id=series_id, season=season_id, episode=episode_id)
+    # Responses are cached by URL and indexed by episode, so a series path without an episode
+    # filter fetches each season only once for all of its episodes
+    with lookup_lock(('tvdb_episode', series_url)):
+        if series_url not in _tvdb_episodes_cache:
+            logger(config, f"TVDB API Series URL:   {series_url}")
+            try:
+                response = tvdb_session.get(series_url, timeout=API_TIMEOUT)
+                series_data = response.json()
+                if series_data["status"] != "success":
+                    return None
+
+                episode_list = series_data['data'].get('episodes') or []
+                episodes_by_number = {
+                    (episode.get('seasonNumber'), episode.get('number')): episode
+                    for episode in episode_list
+                }
+                series = series_data['data'].get('series')
+            except Exception:
+                return None
+
+            _tvdb_episodes_cache[series_url] = (series, episode_list, episodes_by_number)
+        series, episode_list, episodes_by_number = _tvdb_episodes_cache[series_url]
+
+    episode = episodes_by_number.get((season_id, episode_id))
+    if episode is None and len(episode_list) == 1 and episodes_by_number.keys() == {(None, None)}:
+        # The only episode carries no numbering to match against; trust that the API filtered the
+        # response down to the requested episode
+        episode = episode_list[0]
+    if episode is None:
+        return None
+    return series, episode
+
+def tmdb_search(config, tmdb_session, search_movie_title):
+    """
+    Search TMDB for a movie title, returning the list of results or None on failure
+    """
+
+    with lookup_lock(('tmdb_search', search_movie_title)):
+        if search_movie_title in _tmdb_search_cache:
+            return _tmdb_search_cache[search_movie_title]
+
+        # Movie searches are joined with "+" (see search_overrides); send those as encoded spaces
+        movie_url = config['tmdb_api_url'].format(key=config['tmdb_api_key'], title=quote_plus(search_movie_title.replace('+', ' ')))
+        logger(config, f"TMDB API URL:     {movie_url}")
+        try:
+            response = tmdb_session.get(movie_url, timeout=API_TIMEOUT)
+            movie_data = response.json()
+            # An error payload carries no results; report it, and leave it uncached for the next file
+            if movie_data.get('results') is None:
+                raise ValueError
+        except Exception:
+            logger(config, f"Failed to find results for {movie_url}")
+            return None
+
+        _tmdb_search_cache[search_movie_title] = movie_data['results']
+        return movie_data['results']
+
+def split_name(path):
+    """
+    Split the basename of path into its name and extension, like os.path.splitext
+    """
+
+    name = path[path.rfind('/') + 1:]
+    dot = name.rfind('.')
+    # A leading dot (a hidden file) does not start an extension
+    if dot > 0:
+        return name[:dot], name[dot:]
+    return name, ''
+
+def is_year(word):
+    """
+    Return whether word is exactly 4 ASCII numerals, without involving the regex engine
+    """
+
+    return len(word) == 4 and word.isascii() and word.isdigit()
 
 # TV file/directory sorting
-def sort_tv_file(config, srcpath, dstpath):
+def sort_tv_file(config, srcpath, dstpath, tvdb_session):
     """
     TV handling
     """
 
-    # Get basename from the path
-    basename = os.path.basename(srcpath)
-    # Discard the extension to get the filename
-    filename = os.path.splitext(basename)[0]
-    fileext = os.path.splitext(basename)[-1]
-
-    if not fileext in config['valid_extensions']:
-        return False, False
+    # Split the basename into the filename and extension
+    filename, fileext = split_name(srcpath)
 
-    # Try splitting the filename
-    for split_character in config['split_characters']:
-        split_filename = filename.split(split_character)
-        if len(split_filename) >= config['min_split_length']:
-            break
+    # Split the filename on any of the split characters in one pass
+    split_filename = config['split_regex'].split(filename)
     if len(split_filename) < config['min_split_length']:
-        logger(config, "Error: Filename '{}' could not be split into sufficient parts to be parsed.".format(filename))
+        logger(config, f"Error: Filename '{filename}' could not be split into sufficient parts to be parsed.")
         return False, False
 
     # Get the series title and SXXEYY identifier, then end; we get the rest from TVDB
@@ -72,35 +335,37 @@ def sort_tv_file(config, srcpath, dstpath):
     episode_id = 0
     next_match_flag_episode = False
     for idx, element in enumerate(split_filename):
-        if re.search('[Ss][0-9]+[Ee][0-9]+', element):
+        match = _RE_SXXEYY.search(element)
+        if match:
             sxxeyy_idx = idx
-            seid = re.findall('[Ss]([0-9]+)[Ee]([0-9]+)', element)[0]
-            season_id = int(seid[0])
-            episode_id = int(seid[1])
+            season_id = int(match.group(1))
+            episode_id = int(match.group(2))
+            break
     if sxxeyy_idx < 1:
         for idx, element in enumerate(split_filename):
-            if re.search('[Ss][0-9]+', element):
-                if sxxeyy_idx < 1:
-                    sxxeyy_idx = idx
-                seid = re.findall('[Ss]([0-9]+)', element)[0]
-                season_id = int(seid[0])
-            if re.search('[Ee][0-9]+', element):
-                if sxxeyy_idx < 1:
-                    sxxeyy_idx = idx
-                seid = re.findall('[Ee]([0-9]+)', element)[0]
-                episode_id = int(seid[0])
-            if re.search('[Ee]pisode', element):
-                if sxxeyy_idx < 1:
-                    sxxeyy_idx = idx
-                    if not re.findall(r'[0-9]+', element)[0]:
+            if next_match_flag_episode:
+                # The previous element was a bare "Episode"; this one holds the number
+                match = _RE_DIGITS.search(element)
+                if match:
+                    episode_id = int(match.group(1))
+            else:
+                match = _RE_SE.search(element)
+                if match:
+                    if sxxeyy_idx < 1:
+                        sxxeyy_idx = idx
+                    season_match, season_episode_match, episode_match = match.groups()
+                    if season_match:
+                        season_id = int(season_match)
+                    if season_episode_match or episode_match:
+                        episode_id = int(season_episode_match or episode_match)
+                elif _RE_EPISODE_WORD.search(element):
+                    if sxxeyy_idx < 1:
+                        sxxeyy_idx = idx
+                    match = _RE_DIGITS.search(element)
+                    if not match:
                         next_match_flag_episode = True
                         continue
-                    else:
-                        seid = re.findall('([0-9]+)', element)[0]
-                        episode_id = int(seid[0])
-            if next_match_flag_episode:
-                seid = re.findall('([0-9]+)', element)[0]
-                episode_id = int(seid[0])
+                    episode_id = int(match.group(1))
             if episode_id > 0:
                 if season_id == 0:
                     season_id = 1
@@ -111,80 +376,56 @@ def sort_tv_file(config, srcpath, dstpath):
     if not raw_series_title_unfixed:
         # Handle cases where the filename is like DexterS01E03 or similar stupid naming
         raw_series_title_unfixed = split_filename[0:sxxeyy_idx+1]
-    raw_series_title = list()
-    for word in raw_series_title_unfixed:
-        # Remove SXXEYY from the word
-        if re.search(r'[Ss][0-9]+[Ee][0-9]+', word):
-            word = re.sub(r'[Ss][0-9]+[Ee][0-9]+', '', word)
-        # Only remove years that are in parentheses
-        if re.search(r'^\(([0-9]{4})\)$', word):
-            continue
-        raw_series_title.append(word)
-    search_series_title = ' '.join([x.lower() for x in raw_series_title])
-    if search_series_title in config['search_overrides']:
-        search_series_title = config['search_overrides'][search_series_title]
-    logger(config, "Raw file info:    series='{}' S={} E={}".format(search_series_title, season_id, episode_id))
-
-    # Log in to TVDB
-    tvdb_login_url = "{}/login".format(config['tvdb_api_base'])
-    try:
-        data = {"apikey": config['tvdb_api_key'], "pin": ""}
-        response = requests.post(
-            tvdb_login_url,
-            data=json.dumps(data),
-            headers={"Content-Type": "application/json"}
-        )
-        tvdb_token = response.json()['data']['token']
-    except Exception:
-        logger(config, "Failed to log in to TVDB")
-        return False, False
-
-    tvdb_headers = {"Authorization": "Bearer {}".format(tvdb_token)}
-
-    # Fetch series information from TVDB
-    show_path = config['tvdb_api_search_path'].format(show=requests.utils.quote(search_series_title))
-    show_url = '{}/{}'.format(config['tvdb_api_base'], show_path)
-    logger(config, "TVDB API Search URL:   {}".format(show_url))
-    try:
-        response = requests.get(show_url, headers=tvdb_headers)
-        show_data = response.json()
-        if show_data["status"] != "success":
-            raise ValueError
-    except Exception:
-        logger(config, "Failed to find results for {}".format(show_url))
-        return False, False
+    # Remove SXXEYY from each word (sub leaves words without one untouched), then drop
+    # only those years that are in parentheses, feeding the join directly
+    stripped_words = (_RE_SXXEYY.sub('', word) for word in raw_series_title_unfixed)
+    search_series_title = ' '.join(
+        word for word in stripped_words
+        if not (word[:1] == '(' and word[-1:] == ')' and is_year(word[1:-1]))
+    ).lower()
+    search_series_title = config['search_overrides'].get(search_series_title, search_series_title)
+    logger(config, f"Raw file info:    series='{search_series_title}' S={season_id} E={episode_id}")
+
+    # A search override of "id:<TVDB ID>" names the series directly; otherwise, an earlier file
+    # in this run may already have resolved the same search to a series
+    override_id = None
+    if isinstance(search_series_title, int):
+        override_id = search_series_title
+        search_series_title = str(search_series_title)
+    elif search_series_title.startswith('id:') and search_series_title[3:].isdigit():
+        override_id = int(search_series_title[3:])
+    series_id = override_id if override_id is not None else _tvdb_series_id_cache.get(search_series_title)
 
     found_episode = None
-    for series in show_data['data']:
-        series_id = series['tvdb_id']
-
-        # Get episodes list from TVDB
-        series_path = config['tvdb_api_series_path'].format(id=series_id, season=season_id, episode=episode_id)
-        series_url = '{}/{}'.format(config['tvdb_api_base'], series_path)
-        logger(config, "TVDB API Series URL:   {}".format(series_url))
-        try:
-            response = requests.get(series_url, headers=tvdb_headers)
-            series_data = response.json()
-            if series_data["status"] != "success" or not series_data["data"]["episodes"]:
+    if series_id is not None:
+        found_episode = tvdb_episode(config, tvdb_session, series_id, season_id, episode_id)
+
+    if found_episode is None and override_id is None:
+        # Fetch series information from TVDB
+        series_list = tvdb_search(config, tvdb_session, search_series_title)
+        if series_list is None:
+            return False, False
+
+        for series in series_list:
+            # Get the episode from TVDB
+            found_episode = tvdb_episode(config, tvdb_session, series['tvdb_id'], season_id, episode_id)
+            if found_episode is None:
                 continue
-            found_episode = series_data
+            _tvdb_series_id_cache[search_series_title] = series['tvdb_id']
             break
-        except Exception:
-            continue
 
     if found_episode is None:
-        logger(config, "Failed to find results for {}".format(show_url))
+        logger(config, f"Failed to find results for '{search_series_title}'")
         return False, False
     
+    series, episode = found_episode
+
     # Get the series title
-    series_title = found_episode["data"]["series"]['name']
-    for title in config['tv_name_overrides']:
-        if title == series_title:
-            series_title = config['tv_name_overrides'][title]
-            break
+    series_title = series['name']
+    series_title = config['tv_name_overrides'].get(series_title, series_title)
 
     # Get the episode details
-    episode_title = found_episode["data"]["episodes"][0].get('name')
+    episode_title = episode.get('name')
     # Sometimes, we get a slash; only invalid char on *NIX so replace it
     episode_title = episode_title.replace('/', '-')
     # Remove double-quotes because they can cause a lot of headaches
@@ -192,54 +433,34 @@ def sort_tv_file(config, srcpath, dstpath):
 
     if config['suffix_the']:
         # Fix leading The's in the series title
-        if re.match('[Tt]he\s(.*)', series_title):
-            series_title = re.match('[Tt]he\s(.*)', series_title).group(1) + ', The'
+        if series_title.startswith(('The ', 'the ')):
+            series_title = series_title[4:] + ', The'
 
     # Build the final path+filename
-    dst_path = '{dst}/{series}/Season {sid}'.format(
-        dst=dstpath,
-        series=series_title.replace('/', '-'),
-        sid=season_id,
-    )
-    dst_name = '{series} - S{sid:02d}E{eid:02d} - {title}'.format(
-        series=series_title.replace('/', '-'),
-        sid=season_id,
-        eid=episode_id,
-        title=episode_title,
-    )
-    dst_file = '{dst_name}{ext}'.format(
-        dst_name=dst_name,
-        ext=fileext
-    )
-
-    logger(config, "Sorted full filepath:  {}/{}".format(dst_path, dst_file))
-    logger(config, "Sorted full filepath:  {}/{}".format(dst_path, dst_file), stderr=False)
-    logger(config, "Sorted media:  {}".format(dst_name))
-    logger(config, "Sorted media:  {}".format(dst_name), stderr=False)
+    series_name = series_title.replace('/', '-')
+    dst_path = os.path.join(dstpath, series_name, f'Season {season_id}')
+    dst_name = f'{series_name} - S{season_id:02d}E{episode_id:02d} - {episode_title}'
+    dst_file = f'{dst_name}{fileext}'
+
+    logger(config, f"Sorted full filepath:  {dst_path}/{dst_file}")
+    logger(config, f"Sorted full filepath:  {dst_path}/{dst_file}", stderr=False)
+    logger(config, f"Sorted media:  {dst_name}")
+    logger(config, f"Sorted media:  {dst_name}", stderr=False)
 
     return dst_path, dst_file
 
-def sort_movie_file(config, srcpath, dstpath, metainfo_tag):
+def sort_movie_file(config, srcpath, dstpath, metainfo_tag, tmdb_session):
     """
     Movie handling
     """
 
-    # Get basename from the path
-    basename = os.path.basename(srcpath)
-    # Discard the extension to get the filename
-    filename = os.path.splitext(basename)[0]
-    fileext = os.path.splitext(basename)[-1]
-
-    if not fileext in config['valid_extensions']:
-        return False, False
+    # Split the basename into the filename and extension
+    filename, fileext = split_name(srcpath)
 
-    # Try splitting the filename
-    for split_character in config['split_characters']:
-        split_filename = filename.split(split_character)
-        if len(split_filename) >= config['min_split_length']:
-            break
+    # Split the filename on any of the split characters in one pass
+    split_filename = config['split_regex'].split(filename)
     if len(split_filename) < config['min_split_length']:
-        logger(config, "Error: Filename '{}' could not be split into sufficient parts to be parsed.".format(filename))
+        logger(config, f"Error: Filename '{filename}' could not be split into sufficient parts to be parsed.")
         return False, False
 
     # Get the year identifier, then end; we get the rest from TVDB
@@ -247,231 +468,318 @@ def sort_movie_file(config, srcpath, dstpath, metainfo_tag):
     search_movie_year = "0000"
     for idx, element in enumerate(split_filename):
         # A year is an element exactly matching 4 numerals optionally wrapped in parens
-        match = re.match('^\(?([0-9]{4})\)?$', element)
-        if match:
+        year = element[1:] if element[:1] == '(' else element
+        year = year[:-1] if year[-1:] == ')' else year
+        if is_year(year):
             year_idx = idx
-            search_movie_year = match.group(1)
+            search_movie_year = year
             # Don't break here, since we always want the last year (e.g. in "2001 A Space Odyssey")
 
     # Series title: start to year_idx
     raw_movie_title = split_filename[0:year_idx]
-    search_movie_title = '+'.join([x.lower() for x in raw_movie_title])
+    search_movie_title = '+'.join(raw_movie_title).lower()
     # Remove the first "The" from the title when searching to avoid weird conflicts
-    search_movie_title = re.sub('[Tt]he\+', '', search_movie_title, 1)
+    search_movie_title = _RE_THE_PLUS.sub('', search_movie_title, 1)
     # Apply overrides
-    if search_movie_title in config['search_overrides']:
-        search_movie_title = config['search_overrides'][search_movie_title]
-    logger(config, "Raw file info:    movie='{}' year={}".format(search_movie_title, search_movie_year))
+    search_movie_title = config['search_overrides'].get(search_movie_title, search_movie_title)
+    logger(config, f"Raw file info:    movie='{search_movie_title}' year={search_movie_year}")
 
     # Fetch movie information from TMDB
-    movie_path = config['tmdb_api_path'].format(key=config['tmdb_api_key'], title=requests.utils.quote(search_movie_title))
-    movie_url = '{}/{}'.format(config['tmdb_api_base'], movie_path)
-    logger(config, "TMDB API URL:     {}".format(movie_url))
-    try:
-        response = requests.get(movie_url)
-        movie_data = response.json()
-    except Exception:
-        logger(config, "Failed to find results for {}".format(show_url))
+    movie_list = tmdb_search(config, tmdb_session, search_movie_title)
+    if movie_list is None:
         return False, False
-    
+
     # List all movies and find the one matching the year (within on year either side)
-    movie_list = movie_data.get('results')
     movie_title = 'unnamed'
     movie_year = '0000'
     if len(movie_list) == 1:
         # If there's exactly one result, then we just use that
         movie_title = movie_list[0].get('title')
-        movie_year = movie_list[0].get('release_date', '0000-00-00').split('-')[0]
+        movie_year = (movie_list[0].get('release_date') or '0000')[:4]
     else:
         # Otherwise, loop through the results and select the movie with the closest year
+        search_year = int(search_movie_year) if search_movie_year.isdigit() else 0
         for movie in movie_list:
-            release_year = movie.get('release_date', '0000-00-00').split('-')[0]
-            if not release_year:
-                release_year = '0000'
-            if not search_movie_year:
-                search_movie_year = '0000'
-    
-            if search_movie_year == '0000' or release_year == search_movie_year:
+            # Release dates are YYYY-MM-DD, so the year is always the first four characters
+            release_year = (movie.get('release_date') or '0000')[:4]
+            release_year_int = int(release_year) if release_year.isdigit() else 0
+
+            if search_year == 0 or release_year_int == search_year:
                 movie_title = movie.get('title')
                 movie_year = release_year
                 break
-            elif int(release_year) == int(search_movie_year) + 1 or int(release_year) == int(search_movie_year) - 1:
+            elif abs(release_year_int - search_year) == 1:
                 movie_title = movie.get('title')
                 movie_year = release_year
                 # Candidate, but don't break
 
     if movie_title == 'unnamed':
-        logger(config, "Error: No movie was found in the database for filename '{}'.".format(filename))
+        logger(config, f"Error: No movie was found in the database for filename '{filename}'.")
         return False, False
 
-    for title in config['movie_name_overrides']:
-        if title == movie_title:
-            movie_title = config['movie_name_overrides'][title]
-            break
+    movie_title = config['movie_name_overrides'].get(movie_title, movie_title)
 
     if config['suffix_the']:
         # Fix leading The's in the movie title
-        if re.match('[Tt]he\s(.*)', movie_title):
-            movie_title = re.match('[Tt]he\s(.*)', movie_title).group(1) + ', The'
+        if movie_title.startswith(('The ', 'the ')):
+            movie_title = movie_title[4:] + ', The'
 
     # Build the final path+filename
-    dst_path = '{dst}/{movie} ({year})'.format(
-        dst=dstpath,
-        movie=movie_title,
-        year=movie_year
-    )
+    dst_path = os.path.join(dstpath, f'{movie_title} ({movie_year})')
     if metainfo_tag:
         # Pull metainfo from filename if it is in the map
-        metainfo = list()
-        for item in config['metainfo_map']:
-            for idx, element in enumerate(split_filename):
-                key, value = list(item.items())[0]
-                if re.fullmatch(key, element) and value not in metainfo:
-                    metainfo.append(value)
-
-        dst_name = '{movie} ({year}) - [{metainfo}]'.format(
-            dst=dstpath,
-            movie=movie_title,
-            year=movie_year,
-            metainfo=' '.join(metainfo)
-        )
+        # A dict keeps the map order while giving constant-time duplicate checks
+        metainfo = dict()
+        for pattern, value in config['metainfo_map']:
+            if value in metainfo:
+                continue
+            if any(pattern.fullmatch(element) for element in split_filename):
+                metainfo[value] = True
+
+        dst_name = f"{movie_title} ({movie_year}) - [{' '.join(metainfo)}]"
     else:
-        dst_name = '{movie} ({year})'.format(
-            dst=dstpath,
-            movie=movie_title,
-            year=movie_year
-        )
-    dst_file = '{dst_name}{ext}'.format(
-        dst_name=dst_name,
-        ext=fileext
-    )
+        dst_name = f'{movie_title} ({movie_year})'
+    dst_file = f'{dst_name}{fileext}'
 
-    logger(config, "Sorted full filepath:  {}/{}".format(dst_path, dst_file))
-    logger(config, "Sorted full filepath:  {}/{}".format(dst_path, dst_file), stderr=False)
-    logger(config, "Sorted media:  {}".format(dst_name))
-    logger(config, "Sorted media:  {}".format(dst_name), stderr=False)
+    logger(config, f"Sorted full filepath:  {dst_path}/{dst_file}")
+    logger(config, f"Sorted full filepath:  {dst_path}/{dst_file}", stderr=False)
+    logger(config, f"Sorted media:  {dst_name}")
+    logger(config, f"Sorted media:  {dst_name}", stderr=False)
 
     return dst_path, dst_file
 
 # File sorting main function
-def sort_file(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, user, group, file_mode, directory_mode, metainfo_tag, replace, dryrun):
-    # Get UID and GID for chowning if applicable
-    if chown:
-        uid = pwd.getpwnam(user)[2]
-        gid = grp.getgrnam(group)[2]
-    else:
-        uid = None
-        gid = None
-
-    logger(config, ">>> Parsing {}".format(srcpath))
+def sort_file(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, metainfo_tag, replace, dryrun, session):
     # Determine if srcpath is a directory, then act recursively
     if os.path.isdir(srcpath):
-        for filename in sorted(os.listdir(srcpath)):
-            child_filename = '{}/{}'.format(srcpath, filename)
-            returncode = sort_file(config, child_filename, dstpath, mediatype, action, infofile, shasum, chown, user, group, file_mode, directory_mode, metainfo_tag, replace, dryrun)
-            if returncode > 0:
-                logger(config, "Failed to sort file {}".format(srcpath))
+        logger(config, f">>> Parsing {srcpath}")
+        sort_directory(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, metainfo_tag, replace, dryrun, session)
         return 0
 
-    logger(config, "Sorting action:   {}".format(action))
+    return sort_single_file(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, metainfo_tag, replace, dryrun, session)
+
+# Directory sorting
+def list_media_files(config, srcpath):
+    """
+    Return the paths of all media files under srcpath, walking into subdirectories
+    """
+
+    media_files = list()
+    # Directories already walked, by device and inode, so a symlink loop is only walked once
+    visited_dirs = set()
+    # Walk the tree with an explicit stack rather than recursion, so deep trees cannot hit the
+    # recursion limit; subdirectories are pushed in reverse to keep them in name order
+    pending_dirs = [srcpath]
+    while pending_dirs:
+        dirpath = pending_dirs.pop()
+        dir_stat = os.stat(dirpath)
+        if (dir_stat.st_dev, dir_stat.st_ino) in visited_dirs:
+            logger(config, f"Skipping already parsed directory {dirpath}")
+            continue
+        visited_dirs.add((dir_stat.st_dev, dir_stat.st_ino))
+        if dirpath != srcpath:
+            logger(config, f">>> Parsing {dirpath}")
+
+        # Directory entries carry their file type from the listing itself, so no per-entry stat is needed
+        with os.scandir(dirpath) as dir_entries:
+            entries = sorted(dir_entries, key=lambda entry: entry.name)
+
+        child_dirs = list()
+        for entry in entries:
+            # Unlike os.path.isdir, this raises for e.g. a symlink that cannot be resolved
+            try:
+                is_dir = entry.is_dir()
+            except OSError as e:
+                logger(config, f"Error: Failed to check '{entry.path}': {e}")
+                continue
+            if is_dir:
+                child_dirs.append(entry.path)
+            # Only media files are sorted; skip anything else before doing any parsing
+            elif split_name(entry.name)[1].lower() in config['valid_extensions']:
+                media_files.append(entry.path)
+        pending_dirs.extend(reversed(child_dirs))
+
+    return media_files
+
+def sort_directory(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, metainfo_tag, replace, dryrun, session):
+    """
+    Sort every media file under srcpath in parallel
+    """
+
+    # Collect the whole tree first, so files spread over many small subdirectories (e.g. one per
+    # release) still share a single pool of threads
+    child_files = list_media_files(config, srcpath)
+
+    # Each file's messages are held until it is done, rather than interleaving them with other threads'
+    def find_child_destination(child_file):
+        log_entries = list()
+        try:
+            file_dst_path, file_dst_filename = buffer_log(log_entries, find_destination, config, child_file, dstpath, mediatype, action, metainfo_tag, session)
+        except Exception:
+            flush_log(config, log_entries)
+            raise
+        return child_file, file_dst_path, file_dst_filename, log_entries
+
+    def sort_destination_group(group):
+        returncodes = list()
+        for child_file, file_dst_path, file_dst_filename, log_entries in group:
+            try:
+                if file_dst_filename:
+                    returncode = buffer_log(log_entries, place_file, config, child_file, file_dst_path, file_dst_filename, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, replace, dryrun)
+                else:
+                    returncode = 1
+            finally:
+                flush_log(config, log_entries)
+            returncodes.append((child_file, returncode))
+        return returncodes
+
+    # Sorting is dominated by API requests, hashing and filesystem operations, all of which release
+    # the GIL, so threads overlap well
+    with ThreadPoolExecutor(max_workers=config['parallelism']) as executor:
+        # Parse and look up every file first, so that files sharing a destination (e.g. several
+        # releases of one episode) are known before anything is placed
+        destination_groups = dict()
+        for child_destination in executor.map(find_child_destination, child_files):
+            child_file, file_dst_path, file_dst_filename, log_entries = child_destination
+            if file_dst_filename:
+                group_key = ('dst', os.path.join(file_dst_path, file_dst_filename))
+            else:
+                group_key = ('src', child_file)
+            destination_groups.setdefault(group_key, list()).append(child_destination)
+
+        # Files sharing a destination are placed one after another in name order, as a sequential
+        # run would, so --replace always leaves the last of them and --no-replace the first; only
+        # distinct destinations are placed in parallel
+        returncodes = dict()
+        for group_returncodes in executor.map(sort_destination_group, destination_groups.values()):
+            returncodes.update(group_returncodes)
+
+    for child_file in child_files:
+        if returncodes[child_file] > 0:
+            logger(config, f"Failed to sort file {child_file}")
+
+# Target directories known to exist, so later files sorted into the same one skip the syscall
+_ensured_dirs = set()
+
+# Single file sorting
+def sort_single_file(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, metainfo_tag, replace, dryrun, session):
+    file_dst_path, file_dst_filename = find_destination(config, srcpath, dstpath, mediatype, action, metainfo_tag, session)
+    if not file_dst_filename:
+        return 1
+
+    return place_file(config, srcpath, file_dst_path, file_dst_filename, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, replace, dryrun)
+
+def find_destination(config, srcpath, dstpath, mediatype, action, metainfo_tag, session):
+    """
+    Parse srcpath and look up its metadata, returning its target directory and filename (False on failure)
+    """
+
+    logger(config, f">>> Parsing {srcpath}")
+    if split_name(srcpath)[1].lower() not in config['valid_extensions']:
+        logger(config, f"Error: File '{srcpath}' does not have a valid media file extension.")
+        return False, False
+
+    logger(config, f"Sorting action:   {action}")
 
     # Get our destination path and filename (media-specific)
     if mediatype == 'tv':
-        file_dst_path, file_dst_filename = sort_tv_file(config, srcpath, dstpath)
+        return sort_tv_file(config, srcpath, dstpath, session)
     if mediatype == 'movie':
-        file_dst_path, file_dst_filename = sort_movie_file(config, srcpath, dstpath, metainfo_tag)
+        return sort_movie_file(config, srcpath, dstpath, metainfo_tag, session)
 
-    if not file_dst_filename:
-        return 1
+def place_file(config, srcpath, file_dst_path, file_dst_filename, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, replace, dryrun):
+    """
+    Sort srcpath to file_dst_filename in file_dst_path with the given action
+    """
 
     # Ensure our dst_path exists or create it
-    if not os.path.isdir(file_dst_path) and not dryrun:
-        logger(config, "Creating target directory '{}'".format(file_dst_path))
-        os.makedirs(file_dst_path)
-        if chown:
-            os.chown(file_dst_path, uid, gid)
-            os.chmod(file_dst_path, int(directory_mode, 8))
+    if not dryrun and file_dst_path not in _ensured_dirs:
+        # Just try to create it; usually it already exists, and this also avoids racing other threads
+        try:
+            os.makedirs(file_dst_path)
+            logger(config, f"Created target directory '{file_dst_path}'")
+            if chown:
+                os.chown(file_dst_path, uid, gid)
+                os.chmod(file_dst_path, directory_mode)
+        except FileExistsError:
+            pass
+        _ensured_dirs.add(file_dst_path)
 
-    file_dst = '{}/{}'.format(file_dst_path, file_dst_filename)
+    file_dst = os.path.join(file_dst_path, file_dst_filename)
+
+    action_func, action_cmd = SORT_ACTIONS[action]
 
     if dryrun:
-        # Make the output quoted
-        srcpath = '"{}"'.format(srcpath)
-        file_dst = '"{}"'.format(file_dst)
-
-    # Perform our action
-    if action == 'symlink':
-        action_cmd = ['ln', '-s', '{}'.format(srcpath), '{}'.format(file_dst)]
-    if action == 'hardlink':
-        action_cmd = ['ln', '{}'.format(srcpath), '{}'.format(file_dst)]
-    if action == 'copy':
-        action_cmd = ['cp', '{}'.format(srcpath), '{}'.format(file_dst)]
-    if action == 'move':
-        action_cmd = ['mv', '{}'.format(srcpath), '{}'.format(file_dst)]
- 
-    if dryrun:
-        logger(config, "Sort command: {}".format(' '.join(action_cmd)))
+        # Show the equivalent command, with the paths quoted
+        action_cmd = action_cmd + [f'"{srcpath}"', f'"{file_dst}"']
+        logger(config, f"Sort command: {' '.join(action_cmd)}")
         return 0
 
     # Handle upgrading by removing existing dest file
-    dst_path = Path(file_dst)
-    if dst_path.exists():
+    # lexists, so that a dangling symlink left at the destination is also replaced
+    if os.path.lexists(file_dst):
         if replace:
             logger(config, "Removing existing destination file for replacement... ", nl=False)
-            os.remove(file_dst)
+            os.unlink(file_dst)
             logger(config, "done.")
         else:
-            logger(config, "Destination file exists; skipping.")
+            logger(config, f"Destination file '{file_dst}' exists; skipping.")
             return 1
 
     # Run the action
     logger(config, "Running sort action... ", nl=False)
-    process = subprocess.run(action_cmd)
-    retcode = process.returncode
+    try:
+        action_func(srcpath, file_dst)
+    except OSError as e:
+        logger(config, "failed.")
+        logger(config, f"Error: Failed to {action} '{srcpath}' to '{file_dst}': {e}")
+        return 1
     logger(config, "done.")
 
-    if retcode != 0:
-        return retcode
-
     # Create info file
     if infofile:
         logger(config, "Creating info file... ", nl=False)
-        infofile_name = '{}.txt'.format(file_dst)
+        infofile_name = f'{file_dst}.txt'
         infofile_contents = [
-            "Source filename:  {}".format(os.path.basename(srcpath)),
-            "Source directory: {}".format(os.path.dirname(srcpath))
+            f"Source filename:  {os.path.basename(srcpath)}",
+            f"Source directory: {os.path.dirname(srcpath)}"
         ]
         with open(infofile_name, 'w') as fh:
             fh.write('\n'.join(infofile_contents))
             fh.write('\n')
+            if chown:
+                os.fchown(fh.fileno(), uid, gid)
+                os.fchmod(fh.fileno(), file_mode)
         logger(config, "done.")
 
     # Create sha256sum file
     if shasum:
         logger(config, "Generating shasum file... ", nl=False)
-        shasum_name = '{}.sha256sum'.format(file_dst)
-        shasum_cmdout = subprocess.run(['sha256sum', '-b', '{}'.format(file_dst)], capture_output=True, encoding='utf8')
-        shasum_data = shasum_cmdout.stdout
-        if shasum_data:
-            shasum_data = shasum_data.strip()
+        shasum_name = f'{file_dst}.sha256sum'
+        # Same format as 'sha256sum -b'
+        shasum_data = f'{sha256_file(file_dst)} *{file_dst}'
         with open(shasum_name, 'w') as fh:
             fh.write(shasum_data)
             fh.write('\n')
+            if chown:
+                os.fchown(fh.fileno(), uid, gid)
+                os.fchmod(fh.fileno(), file_mode)
         logger(config, "done.")
 
     if chown:
         logger(config, "Correcting ownership and permissions... ", nl=False)
-        os.chown(file_dst, uid, gid)
-        os.chmod(file_dst, int(file_mode, 8))
-        if infofile:
-            os.chown(infofile_name, uid, gid)
-            os.chmod(infofile_name, int(file_mode, 8))
-        if shasum:
-            os.chown(shasum_name, uid, gid)
-            os.chmod(shasum_name, int(file_mode, 8))
+        # Resolve the path once and work on the descriptor; like chown/chmod on the path, this
+        # follows a symlinked destination to its target. The info and shasum files were already
+        # handled through their own descriptors when written.
+        dst_fd = os.open(file_dst, os.O_RDONLY)
+        try:
+            os.fchown(dst_fd, uid, gid)
+            os.fchmod(dst_fd, file_mode)
+        finally:
+            os.close(dst_fd)
         logger(config, "done.")
 
-    return retcode
+    return 0
 
 ###############################################################################
 # CLICK
@@ -568,9 +876,9 @@ def cli_root(srcpath, dstpath, mediatype, action, infofile, shasum, chown, user,
     # Parse the configuration file
     with open(config_file, 'r') as cfgfile:
         try:
-            o_config = yaml.load(cfgfile, Loader=yaml.SafeLoader)
+            o_config = yaml.load(cfgfile, Loader=SafeLoader)
         except Exception as e:
-            logger(config, 'ERROR: Failed to parse configuration file: {}'.format(e))
+            logger(config, f'ERROR: Failed to parse configuration file: {e}')
             exit(1)
     
     try:
@@ -582,28 +890,78 @@ def cli_root(srcpath, dstpath, mediatype, action, infofile, shasum, chown, user,
             'tmdb_api_base':    o_config['mediasorter']['api']['tmdb']['url'],
             'tmdb_api_path':    o_config['mediasorter']['api']['tmdb']['path'],
             'tmdb_api_key':     o_config['mediasorter']['api']['tmdb']['key'],
-            'valid_extensions': o_config['mediasorter']['parameters']['valid_extensions'],
+            # Extensions are matched case-insensitively
+            'valid_extensions': frozenset(ext.lower() for ext in o_config['mediasorter']['parameters']['valid_extensions']),
             'split_characters': o_config['mediasorter']['parameters']['split_characters'],
             'min_split_length': int(o_config['mediasorter']['parameters']['min_split_length']),
+            'parallelism':      int(o_config['mediasorter']['parameters'].get('parallelism', 8)),
             'suffix_the':       o_config['mediasorter']['parameters']['suffix_the'],
-            'metainfo_map':     o_config['mediasorter']['parameters'].get('metainfo_map', []),
-            'search_overrides': o_config['mediasorter'].get('search_overrides', {}),
+            # Compiled once here rather than for every filename element
+            'metainfo_map':     [
+                (re.compile(key), value)
+                for item in o_config['mediasorter']['parameters'].get('metainfo_map', [])
+                for key, value in item.items()
+            ],
+            # Searches are generated in lowercase, so normalize the keys to match
+            'search_overrides': {
+                str(title).lower(): search
+                for title, search in o_config['mediasorter'].get('search_overrides', {}).items()
+            },
             'tv_name_overrides':   o_config['mediasorter'].get('name_overrides', {}).get('tv', {}),
             'movie_name_overrides':   o_config['mediasorter'].get('name_overrides', {}).get('movie', {}),
             'log_to_file':      o_config['mediasorter']['logging']['file'],
             'logfile':          o_config['mediasorter']['logging']['logfile'],
         }
     except Exception as e:
-        logger(config, 'ERROR: Failed to load configuration: {}'.format(e))
+        logger(config, f'ERROR: Failed to load configuration: {e}')
+        exit(1)
+
+    # Resolve ownership and permissions once, rather than for every file
+    uid = gid = -1
+    if chown:
+        try:
+            uid = pwd.getpwnam(user).pw_uid
+            gid = grp.getgrnam(group).gr_gid
+        except KeyError as e:
+            logger(config, f'ERROR: Failed to find user or group: {e}')
+            exit(1)
+    try:
+        file_mode = int(file_mode, 8)
+        directory_mode = int(directory_mode, 8)
+    except ValueError as e:
+        logger(config, f'ERROR: Invalid file or directory mode: {e}')
         exit(1)
 
+    # Match runs of any of the split characters, so mixed separators split in a single pass
+    split_alternatives = '|'.join(re.escape(split_character) for split_character in config['split_characters'])
+    config['split_regex'] = re.compile(f'(?:{split_alternatives})+')
+
+    # Join the API bases and paths once, leaving only the per-request fields to fill in
+    config['tvdb_api_search_url'] = f"{config['tvdb_api_base']}/{config['tvdb_api_search_path']}"
+    config['tvdb_api_series_url'] = f"{config['tvdb_api_base']}/{config['tvdb_api_series_path']}"
+    config['tmdb_api_url'] = f"{config['tmdb_api_base']}/{config['tmdb_api_path']}"
+
+    # Open the log file once for the whole run; line buffering keeps it current
+    if config['log_to_file'] and config['logfile']:
+        config['logfh'] = open(config['logfile'], 'a', buffering=1)
+        atexit.register(config['logfh'].close)
+
     srcpath = os.path.abspath(os.path.expanduser(srcpath))
     dstpath = os.path.abspath(os.path.expanduser(dstpath))
 
+    # Set up one API session for the whole run; for TV, this logs in to TVDB once rather than
+    # for every file
+    if mediatype == 'tv':
+        session = tvdb_login(config)
+        if session is None:
+            exit(1)
+    else:
+        session = api_session(config)
+
     # Sort the media file
-    returncode = sort_file(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, user, group, file_mode, directory_mode, metainfo_tag, replace, dryrun)
+    returncode = sort_file(config, srcpath, dstpath, mediatype, action, infofile, shasum, chown, uid, gid, file_mode, directory_mode, metainfo_tag, replace, dryrun, session)
     if returncode > 0:
-        logger(config, "Failed to sort file {}".format(srcpath))
+        logger(config, f"Failed to sort file {srcpath}")
     exit(returncode)
 
 # Entry point